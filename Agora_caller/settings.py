@@ -56,6 +56,36 @@ REST_FRAMEWORK = {
 AGORA_APP_ID = os.getenv("AGORA_APP_ID")
 AGORA_APP_CERTIFICATE = os.getenv("AGORA_APP_CERTIFICATE")
 
+# Agora channel event ingestion
+AGORA_EVENT_QUEUE_SIZE = int(os.getenv("AGORA_EVENT_QUEUE_SIZE", 10000))
+AGORA_EVENT_BATCH_SIZE = int(os.getenv("AGORA_EVENT_BATCH_SIZE", 500))
+AGORA_EVENT_FLUSH_INTERVAL = float(os.getenv("AGORA_EVENT_FLUSH_INTERVAL", 0.5))
+AGORA_EVENT_DRAIN_TIMEOUT = float(os.getenv("AGORA_EVENT_DRAIN_TIMEOUT", 10))
+AGORA_EVENT_MAX_RETRIES = int(os.getenv("AGORA_EVENT_MAX_RETRIES", 3))
+AGORA_EVENT_RETRY_DELAY = float(os.getenv("AGORA_EVENT_RETRY_DELAY", 0.5))
+# Hours received events are kept for deduplication; only redeliveries need them.
+AGORA_EVENT_RETENTION_HOURS = int(os.getenv("AGORA_EVENT_RETENTION_HOURS", 72))
+
+# Background task executor. With TASK_QUEUE_DURABLE enabled, deferred tasks are
+# stored in the DeferredTask table and run by the run_task_worker command.
+TASK_WORKERS = int(os.getenv("TASK_WORKERS", 2))
+TASK_QUEUE_SIZE = int(os.getenv("TASK_QUEUE_SIZE", 1000))
+TASK_SUBMIT_TIMEOUT = float(os.getenv("TASK_SUBMIT_TIMEOUT", 0.05))
+TASK_MAX_RETRIES = int(os.getenv("TASK_MAX_RETRIES", 3))
+TASK_RETRY_DELAY = float(os.getenv("TASK_RETRY_DELAY", 0.5))
+TASK_DRAIN_TIMEOUT = float(os.getenv("TASK_DRAIN_TIMEOUT", 10))
+# Running durable tasks whose lease expires are assumed dead and run again.
+TASK_LEASE_SECONDS = int(os.getenv("TASK_LEASE_SECONDS", 300))
+TASK_QUEUE_DURABLE = os.getenv("TASK_QUEUE_DURABLE", "false").lower() == "true"
+
+# Call quality telemetry. Samples are buffered per window and flushed once the
+# window has been closed for TELEMETRY_FLUSH_GRACE seconds.
+TELEMETRY_WINDOW_SECONDS = int(os.getenv("TELEMETRY_WINDOW_SECONDS", 300))
+TELEMETRY_FLUSH_GRACE = int(os.getenv("TELEMETRY_FLUSH_GRACE", 30))
+TELEMETRY_MAX_SAMPLES = int(os.getenv("TELEMETRY_MAX_SAMPLES", 1000))
+TELEMETRY_MAX_SAMPLE_AGE = int(os.getenv("TELEMETRY_MAX_SAMPLE_AGE", 86400))
+TELEMETRY_MAX_CLOCK_SKEW = int(os.getenv("TELEMETRY_MAX_CLOCK_SKEW", 300))
+
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -92,10 +122,31 @@ WSGI_APPLICATION = "Agora_caller.wsgi.application"
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "NAME": os.getenv("SQLITE_PATH", BASE_DIR / "db.sqlite3"),
     }
 }
 
+# High-concurrency SQLite profile for edge deployments. WAL lets readers run
+# alongside the writer, the timeout makes writers wait for the lock instead of
+# failing with "database is locked", and IMMEDIATE transactions take the write
+# lock up front so atomic blocks never fail while upgrading a read lock.
+SQLITE_CONCURRENT = os.getenv("SQLITE_CONCURRENT", "false").lower() == "true"
+if SQLITE_CONCURRENT:
+    DATABASES["default"]["OPTIONS"] = {
+        "timeout": float(os.getenv("SQLITE_TIMEOUT", 20)),
+        "transaction_mode": "IMMEDIATE",
+        "init_command": (
+            "PRAGMA journal_mode=WAL;"
+            "PRAGMA synchronous=NORMAL;"
+            "PRAGMA cache_size=-32000;"
+            "PRAGMA temp_store=MEMORY;"
+            "PRAGMA mmap_size=134217728;"
+        ),
+    }
+
+# Funnel Call, CallUser and AgoraToken writes through one writer thread.
+SQLITE_SINGLE_WRITER = os.getenv("SQLITE_SINGLE_WRITER", "false").lower() == "true"
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -1,5 +1,15 @@
 from django.contrib import admin
-from api.models import AgoraToken, Call, CallUser, MediaControl, Message, ScreenShare
+from api.models import (
+    AgoraEvent,
+    AgoraToken,
+    Call,
+    CallUser,
+    DeferredTask,
+    MediaControl,
+    Message,
+    ScreenShare,
+    TelemetryChunk,
+)
 
 admin.site.register(Call)
 admin.site.register(CallUser)
@@ -7,3 +17,6 @@ admin.site.register(Message)
 admin.site.register(AgoraToken)
 admin.site.register(MediaControl)
 admin.site.register(ScreenShare)
+admin.site.register(AgoraEvent)
+admin.site.register(DeferredTask)
+admin.site.register(TelemetryChunk)
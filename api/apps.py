@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Register the deferrable tasks in every process, so the durable
+        # worker can run them by name without importing arbitrary modules.
+        from . import events, tasks, telemetry  # noqa: F401
@@ -0,0 +1,300 @@
+import base64
+import gzip
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import (
+    AgoraToken,
+    Call,
+    CallUser,
+    MediaControl,
+    Message,
+    ScreenShare,
+    TelemetryChunk,
+)
+
+# Models written to each segment, parents first so a restore can insert rows
+# in file order without violating foreign keys.
+ARCHIVED_MODELS = [
+    Call,
+    CallUser,
+    Message,
+    AgoraToken,
+    MediaControl,
+    ScreenShare,
+    TelemetryChunk,
+]
+MODELS_BY_LABEL = {model._meta.label_lower: model for model in ARCHIVED_MODELS}
+
+ARCHIVABLE_STATUSES = [Call.COMPLETED, Call.CANCELLED]
+SEGMENT_SUFFIX = ".jsonl.gz"
+MANIFEST_SUFFIX = ".manifest.json"
+
+
+class ArchiveError(Exception):
+    pass
+
+
+class ArchiveJSONEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder truncates datetimes to milliseconds; archives keep the
+    # full precision so restored rows match the originals. Binary fields are
+    # base64 encoded, which BinaryField.to_python() decodes on restore.
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        if isinstance(o, (bytes, memoryview)):
+            return base64.b64encode(o).decode()
+        return super().default(o)
+
+
+def archivable_calls(days):
+    """
+    Returns completed or cancelled calls that ended more than `days` days ago.
+    Calls without an `end_time` fall back to their `start_time`.
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    return Call.objects.filter(status__in=ARCHIVABLE_STATUSES).filter(
+        Q(end_time__lt=cutoff) | Q(end_time__isnull=True, start_time__lt=cutoff)
+    )
+
+
+def iter_segment_call_ids(queryset, segment_size):
+    """
+    Yields lists of at most `segment_size` call ids using keyset pagination, so
+    only one segment's ids are held in memory and rows can be deleted between
+    segments without disturbing an open cursor.
+    """
+    last_pk = 0
+    while True:
+        call_ids = list(
+            queryset.filter(pk__gt=last_pk)
+            .order_by("pk")
+            .values_list("pk", flat=True)[:segment_size]
+        )
+        if not call_ids:
+            return
+        yield call_ids
+        last_pk = call_ids[-1]
+
+
+def _rows_for(model, call_ids):
+    if model is Call:
+        queryset = Call.objects.filter(pk__in=call_ids)
+    else:
+        queryset = model.objects.filter(call_id__in=call_ids)
+    attnames = [field.attname for field in model._meta.concrete_fields]
+    return queryset.order_by("pk").values(*attnames)
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def manifest_path(segment_path):
+    return segment_path[: -len(SEGMENT_SUFFIX)] + MANIFEST_SUFFIX
+
+
+def write_segment(path, call_ids, chunk_size=2000):
+    """
+    Streams the given calls and their related rows into a gzip-compressed JSONL
+    file, one `{"model": ..., "fields": ...}` record per line. Rows are read
+    with `.iterator()`, which uses server-side cursors where the backend
+    supports them. Returns the per-model record counts.
+    """
+    counts = {}
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for model in ARCHIVED_MODELS:
+            label = model._meta.label_lower
+            counts[label] = 0
+            for row in _rows_for(model, call_ids).iterator(chunk_size=chunk_size):
+                f.write(
+                    json.dumps({"model": label, "fields": row}, cls=ArchiveJSONEncoder)
+                )
+                f.write("\n")
+                counts[label] += 1
+
+    manifest = {
+        "segment": os.path.basename(path),
+        "sha256": _sha256(path),
+        "counts": counts,
+        "call_ids": [call_ids[0], call_ids[-1]],
+        "created_at": timezone.now().isoformat(),
+    }
+    with open(manifest_path(path), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return counts
+
+
+def read_segment(path):
+    """
+    Yields `(model, fields)` pairs from a segment file, one at a time.
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            model = MODELS_BY_LABEL.get(record.get("model"))
+            if model is None:
+                raise ArchiveError(
+                    f"{path}:{line_number}: unknown model {record.get('model')!r}."
+                )
+            yield model, record["fields"]
+
+
+def read_manifest(path):
+    try:
+        with open(manifest_path(path), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise ArchiveError(f"Manifest for {path} not found.")
+
+
+def verify_segment(path, expected_counts=None):
+    """
+    Checks a segment against its manifest: the checksum must match and the file
+    must decompress to the recorded number of records per model. Raises
+    `ArchiveError` on any mismatch and returns the manifest otherwise.
+    """
+    manifest = read_manifest(path)
+    if _sha256(path) != manifest["sha256"]:
+        raise ArchiveError(f"Checksum mismatch for {path}.")
+
+    counts = {label: 0 for label in MODELS_BY_LABEL}
+    for model, _ in read_segment(path):
+        counts[model._meta.label_lower] += 1
+
+    for expected in filter(None, [manifest["counts"], expected_counts]):
+        for label, count in expected.items():
+            if counts.get(label, 0) != count:
+                raise ArchiveError(
+                    f"{path}: expected {count} {label} records, found "
+                    f"{counts.get(label, 0)}."
+                )
+    return manifest
+
+
+def _record_call_id(model, fields):
+    return fields["id"] if model is Call else fields["call_id"]
+
+
+def _archived_pks(path):
+    # Per model, the primary keys of the archived rows for each call.
+    pks = {label: {} for label in MODELS_BY_LABEL}
+    for model, fields in read_segment(path):
+        per_call = pks[model._meta.label_lower]
+        per_call.setdefault(_record_call_id(model, fields), set()).add(fields["id"])
+    return pks
+
+
+def delete_archived_calls(path, call_ids, chunk_size=500):
+    """
+    Deletes the calls archived in `path` and their related rows in chunked
+    transactions. A call is only deleted when every related table still holds
+    exactly the rows written to the segment, compared by primary key; calls
+    whose rows changed since (a deferred token insert, a late telemetry flush)
+    are kept whole, recorded in the manifest as retained and skipped on
+    restore, so they are archived again by a later run. Returns the retained
+    call ids.
+    """
+    archived = _archived_pks(path)
+    retained = []
+    for start in range(0, len(call_ids), chunk_size):
+        chunk = call_ids[start : start + chunk_size]
+        with transaction.atomic():
+            # Locking the calls blocks new child rows until this chunk commits.
+            locked = list(
+                Call.objects.select_for_update()
+                .filter(pk__in=chunk)
+                .values_list("pk", flat=True)
+            )
+            changed = set()
+            for model in ARCHIVED_MODELS[1:]:
+                expected = archived[model._meta.label_lower]
+                current = {}
+                for call_id, pk in model.objects.filter(call_id__in=locked).values_list(
+                    "call_id", "pk"
+                ):
+                    current.setdefault(call_id, set()).add(pk)
+                changed.update(
+                    call_id
+                    for call_id in locked
+                    if current.get(call_id, set()) != expected.get(call_id, set())
+                )
+
+            deletable = [call_id for call_id in locked if call_id not in changed]
+            for model in reversed(ARCHIVED_MODELS[1:]):
+                model.objects.filter(call_id__in=deletable).delete()
+            Call.objects.filter(pk__in=deletable).delete()
+            retained.extend(sorted(changed))
+
+    if retained:
+        manifest = read_manifest(path)
+        manifest["retained_call_ids"] = retained
+        with open(manifest_path(path), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+    return retained
+
+
+def _bulk_insert(model, objs):
+    # bulk_create() overwrites auto_now_add fields with the current time, so
+    # the archived values are written back afterwards.
+    auto_fields = [
+        field
+        for field in model._meta.concrete_fields
+        if getattr(field, "auto_now_add", False) or getattr(field, "auto_now", False)
+    ]
+    original = [[getattr(obj, f.attname) for f in auto_fields] for obj in objs]
+    model.objects.bulk_create(objs)
+    if auto_fields:
+        for obj, values in zip(objs, original):
+            for field, value in zip(auto_fields, values):
+                setattr(obj, field.attname, value)
+        model.objects.bulk_update(objs, [f.name for f in auto_fields])
+
+
+def restore_segment(path, batch_size=1000, skip_call_ids=()):
+    """
+    Streams a segment back into the database with `bulk_create`, holding at
+    most `batch_size` rows in memory. Records belonging to `skip_call_ids`,
+    the calls that were retained rather than deleted, are left out. The whole
+    segment is restored in one transaction. Returns the per-model record counts.
+    """
+    skip_call_ids = set(skip_call_ids)
+    counts = {label: 0 for label in MODELS_BY_LABEL}
+    pending = {model: [] for model in ARCHIVED_MODELS}
+    buffered = 0
+
+    def flush():
+        for model in ARCHIVED_MODELS:
+            if pending[model]:
+                _bulk_insert(model, pending[model])
+                pending[model] = []
+
+    with transaction.atomic():
+        for model, fields in read_segment(path):
+            if _record_call_id(model, fields) in skip_call_ids:
+                continue
+            values = {
+                field.attname: field.to_python(fields.get(field.attname))
+                for field in model._meta.concrete_fields
+            }
+            pending[model].append(model(**values))
+            counts[model._meta.label_lower] += 1
+            buffered += 1
+            if buffered >= batch_size:
+                flush()
+                buffered = 0
+        flush()
+    return counts
@@ -0,0 +1,393 @@
+import atexit
+import hashlib
+import hmac
+import logging
+import operator
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from functools import reduce
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils.dateparse import parse_datetime
+
+from .models import AgoraEvent, Call, CallUser, DeferredTask
+from .sqlite import serialized_write
+from .tasks import task
+
+logger = logging.getLogger(__name__)
+
+# Agora RTC channel event types.
+CHANNEL_CREATE = 101
+CHANNEL_DESTROY = 102
+BROADCASTER_JOIN = 103
+BROADCASTER_LEAVE = 104
+AUDIENCE_JOIN = 105
+AUDIENCE_LEAVE = 106
+ROLE_TO_BROADCASTER = 111
+ROLE_TO_AUDIENCE = 112
+
+JOIN_EVENTS = {BROADCASTER_JOIN, AUDIENCE_JOIN}
+LEAVE_EVENTS = {BROADCASTER_LEAVE, AUDIENCE_LEAVE}
+ROLE_EVENTS = {
+    ROLE_TO_BROADCASTER: CallUser.HOST,
+    ROLE_TO_AUDIENCE: CallUser.AUDIENCE,
+}
+HANDLED_EVENTS = {CHANNEL_CREATE, CHANNEL_DESTROY} | JOIN_EVENTS | LEAVE_EVENTS
+HANDLED_EVENTS |= set(ROLE_EVENTS)
+
+# Rows targeted by a single CASE ... WHEN update, kept well below SQLite's
+# bound parameter limit.
+UPDATE_CHUNK_SIZE = 200
+
+
+class InvalidEvent(ValueError):
+    pass
+
+
+def verify_signature(body, signature=None, signature_v2=None):
+    """
+    Checks the `Agora-Signature-V2` (HMAC-SHA256) or `Agora-Signature`
+    (HMAC-SHA1) header against the raw request body, keyed with
+    `AGORA_APP_CERTIFICATE`.
+    """
+    secret = settings.AGORA_APP_CERTIFICATE
+    if not secret:
+        return False
+    key = secret.encode()
+    if signature_v2:
+        expected = hmac.new(key, body, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(expected, signature_v2)
+    if signature:
+        expected = hmac.new(key, body, hashlib.sha1).hexdigest()
+        return hmac.compare_digest(expected, signature)
+    return False
+
+
+def parse_event(data):
+    """
+    Builds an unsaved `AgoraEvent` from a notification body. Returns None for
+    event types this app does not act on.
+    """
+    try:
+        event_type = int(data["eventType"])
+        notice_id = str(data["noticeId"])
+        payload = data["payload"]
+        channel_id = str(payload["channelName"])
+        uid = payload.get("uid")
+        uid = int(uid) if uid is not None else None
+        occurred_at = datetime.fromtimestamp(payload["ts"], tz=timezone.utc)
+    except (KeyError, TypeError, ValueError, OverflowError, OSError) as e:
+        raise InvalidEvent(f"Malformed event: {e}")
+
+    if event_type not in HANDLED_EVENTS:
+        return None
+
+    return AgoraEvent(
+        notice_id=notice_id,
+        event_type=event_type,
+        channel_id=channel_id,
+        uid=uid,
+        occurred_at=occurred_at,
+    )
+
+
+def _update_cases(queryset, field, pairs, **constants):
+    """
+    Sets `field` to a per-row value in one UPDATE per chunk, where `pairs` is a
+    list of `(Q, value)` tuples selecting the rows and their new value.
+    """
+    for start in range(0, len(pairs), UPDATE_CHUNK_SIZE):
+        chunk = pairs[start : start + UPDATE_CHUNK_SIZE]
+        value = Case(
+            *[When(condition, then=Value(v)) for condition, v in chunk],
+            output_field=queryset.model._meta.get_field(field).clone(),
+        )
+        condition = reduce(operator.or_, [condition for condition, _ in chunk])
+        queryset.filter(condition).update(**{field: value}, **constants)
+
+
+def _apply_call_events(events):
+    starts = {}
+    ends = {}
+    for event in events:
+        if event.event_type == CHANNEL_CREATE:
+            starts.setdefault(event.channel_id, event.occurred_at)
+        elif event.event_type == CHANNEL_DESTROY:
+            ends[event.channel_id] = event.occurred_at
+
+    # Notifications can arrive late, so stored times are only moved by newer
+    # events: the earliest create is the start and the latest destroy the end.
+    # A pending call's start_time is still its creation time, not an event's.
+    calls = Call.objects.exclude(status=Call.CANCELLED)
+    _update_cases(
+        calls,
+        "start_time",
+        [
+            (
+                Q(channel_id=channel) & (Q(status=Call.PENDING) | Q(start_time__gt=ts)),
+                ts,
+            )
+            for channel, ts in starts.items()
+        ],
+        status=Case(
+            When(status=Call.PENDING, then=Value(Call.ONGOING)), default=F("status")
+        ),
+    )
+    _update_cases(
+        calls,
+        "end_time",
+        [
+            (
+                Q(channel_id=channel) & (Q(end_time__isnull=True) | Q(end_time__lt=ts)),
+                ts,
+            )
+            for channel, ts in ends.items()
+        ],
+        status=Call.COMPLETED,
+    )
+
+
+def _apply_participant_events(events):
+    participant_events = [event for event in events if event.uid is not None]
+    channels = {event.channel_id for event in participant_events}
+    if not channels:
+        return
+    call_ids = dict(
+        Call.objects.filter(channel_id__in=channels).values_list("channel_id", "pk")
+    )
+
+    joined = {}
+    last_joined = {}
+    last_left = {}
+    roles = {}
+    for event in participant_events:
+        call_id = call_ids.get(event.channel_id)
+        if call_id is None:
+            continue
+        key = (call_id, event.uid)
+        if event.event_type in JOIN_EVENTS:
+            joined.setdefault(key, event.occurred_at)
+            last_joined[key] = event.occurred_at
+        elif event.event_type in LEAVE_EVENTS:
+            last_left[key] = event.occurred_at
+        elif event.event_type in ROLE_EVENTS:
+            roles[key] = ROLE_EVENTS[event.event_type]
+
+    def participant(key):
+        call_id, uid = key
+        return Q(call_id=call_id, user_id=uid)
+
+    # As for calls, late events never override newer ones: the earliest join
+    # is kept, a leave only replaces an older one, and a join only clears a
+    # leave that happened before it.
+    left = []
+    for key in last_joined.keys() | last_left.keys():
+        join_ts, leave_ts = last_joined.get(key), last_left.get(key)
+        if leave_ts is not None and (join_ts is None or leave_ts > join_ts):
+            guard = Q(left_at__isnull=True) | Q(left_at__lt=leave_ts)
+            left.append((participant(key) & guard, leave_ts))
+        elif join_ts is not None:
+            left.append((participant(key) & Q(left_at__lt=join_ts), None))
+
+    _update_cases(
+        CallUser.objects.all(),
+        "joined_at",
+        [
+            (participant(key) & (Q(joined_at__isnull=True) | Q(joined_at__gt=ts)), ts)
+            for key, ts in joined.items()
+        ],
+    )
+    _update_cases(CallUser.objects.all(), "left_at", left)
+    _update_cases(
+        CallUser.objects.all(),
+        "role",
+        [(participant(key), role) for key, role in roles.items()],
+    )
+
+
+def apply_events(events):
+    """
+    Records and applies a batch of events with set-based updates. Events whose
+    `notice_id` was already recorded, or repeats within the batch, are skipped.
+    Returns the number of events applied.
+    """
+    unique = {}
+    for event in events:
+        unique.setdefault(event.notice_id, event)
+    seen = set(
+        AgoraEvent.objects.filter(notice_id__in=list(unique)).values_list(
+            "notice_id", flat=True
+        )
+    )
+    fresh = [event for notice_id, event in unique.items() if notice_id not in seen]
+    if not fresh:
+        return 0
+    fresh.sort(key=lambda event: event.occurred_at)
+
+    with transaction.atomic():
+        AgoraEvent.objects.bulk_create(fresh, ignore_conflicts=True)
+        _apply_call_events(fresh)
+        _apply_participant_events(fresh)
+    return len(fresh)
+
+
+def prune_events(before, chunk_size=5000):
+    """
+    Deletes events received before `before` in chunks of `chunk_size` rows, so
+    each delete holds the write lock only briefly. Returns the number deleted.
+    """
+    deleted = 0
+    while True:
+        pks = list(
+            AgoraEvent.objects.filter(received_at__lt=before).values_list(
+                "pk", flat=True
+            )[:chunk_size]
+        )
+        if not pks:
+            return deleted
+        deleted += AgoraEvent.objects.filter(pk__in=pks).delete()[0]
+
+
+def event_to_dict(event):
+    return {
+        "notice_id": event.notice_id,
+        "event_type": event.event_type,
+        "channel_id": event.channel_id,
+        "uid": event.uid,
+        "occurred_at": event.occurred_at.isoformat(),
+    }
+
+
+@task
+def apply_event(data):
+    apply_events(
+        [AgoraEvent(**{**data, "occurred_at": parse_datetime(data["occurred_at"])})]
+    )
+
+
+class EventIngestor:
+    """
+    Buffers events in a bounded in-process queue and applies them in batches
+    from a single background thread.
+    """
+
+    def __init__(self, max_queue_size=None, batch_size=None, flush_interval=None):
+        self.queue = queue.Queue(
+            maxsize=max_queue_size or settings.AGORA_EVENT_QUEUE_SIZE
+        )
+        self.batch_size = batch_size or settings.AGORA_EVENT_BATCH_SIZE
+        self.flush_interval = flush_interval or settings.AGORA_EVENT_FLUSH_INTERVAL
+        self.stats = {"received": 0, "rejected": 0, "applied": 0, "deferred": 0}
+        self._held = []
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="agora-events", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stops the worker once everything already queued has been applied.
+        """
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def submit(self, event, block=False):
+        """
+        Queues an event. Returns False when the queue is full and `block` is
+        not set, so callers can ask the sender to retry.
+        """
+        self.start()
+        try:
+            self.queue.put(event, block=block)
+        except queue.Full:
+            self._count("rejected")
+            return False
+        self._count("received")
+        return True
+
+    def _next_batch(self):
+        batch, self._held = self._held, []
+        try:
+            batch.append(self.queue.get(timeout=self.flush_interval))
+        except queue.Empty:
+            return batch
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        try:
+            while not (
+                self._stopping.is_set() and self.queue.empty() and not self._held
+            ):
+                batch = self._next_batch()
+                if not batch:
+                    continue
+                close_old_connections()
+                self._apply(batch)
+        finally:
+            connection.close()
+
+    def _apply(self, batch):
+        """
+        Applies a batch, retrying with backoff. Agora has already been told the
+        events were accepted, so a batch that keeps failing is stored in the
+        durable task queue for `run_task_worker`, and if even that fails it is
+        held in memory and retried with the next batch.
+        """
+        for attempt in range(settings.AGORA_EVENT_MAX_RETRIES + 1):
+            try:
+                self._count("applied", serialized_write(apply_events, batch))
+                return
+            except Exception:
+                if attempt == settings.AGORA_EVENT_MAX_RETRIES:
+                    logger.exception("Failed to apply %d Agora events", len(batch))
+                    break
+                logger.warning("Retrying %d Agora events", len(batch), exc_info=True)
+                time.sleep(settings.AGORA_EVENT_RETRY_DELAY * 2**attempt)
+
+        try:
+            DeferredTask.objects.bulk_create(
+                [
+                    DeferredTask(name=apply_event.task_name, args=[event_to_dict(e)])
+                    for e in batch
+                ]
+            )
+            self._count("deferred", len(batch))
+        except Exception:
+            logger.exception("Holding %d Agora events for retry", len(batch))
+            self._held.extend(batch)
+
+
+_ingestor = None
+_ingestor_lock = threading.Lock()
+
+
+def get_ingestor():
+    global _ingestor
+    with _ingestor_lock:
+        if _ingestor is None:
+            _ingestor = EventIngestor()
+            atexit.register(_ingestor.stop, settings.AGORA_EVENT_DRAIN_TIMEOUT)
+        return _ingestor
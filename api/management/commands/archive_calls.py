@@ -0,0 +1,81 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.archive import (
+    SEGMENT_SUFFIX,
+    ArchiveError,
+    archivable_calls,
+    delete_archived_calls,
+    iter_segment_call_ids,
+    verify_segment,
+    write_segment,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Archives completed and cancelled calls older than --days into "
+        "compressed JSONL segments, verifies them and deletes the archived rows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=90)
+        parser.add_argument("--output-dir", default="archive")
+        parser.add_argument(
+            "--segment-size", type=int, default=1000, help="Calls per segment file."
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=500,
+            help="Calls deleted per transaction.",
+        )
+        parser.add_argument(
+            "--keep",
+            action="store_true",
+            help="Write and verify segments without deleting the archived rows.",
+        )
+
+    def handle(self, *args, **options):
+        os.makedirs(options["output_dir"], exist_ok=True)
+        stamp = timezone.now().strftime("%Y%m%dT%H%M%S")
+        queryset = archivable_calls(options["days"])
+
+        segments = 0
+        archived = 0
+        for number, call_ids in enumerate(
+            iter_segment_call_ids(queryset, options["segment_size"]), start=1
+        ):
+            path = os.path.join(
+                options["output_dir"], f"calls-{stamp}-{number:05d}{SEGMENT_SUFFIX}"
+            )
+            counts = write_segment(path, call_ids)
+            try:
+                verify_segment(path, expected_counts=counts)
+            except ArchiveError as e:
+                raise CommandError(f"{e} Rows for this segment were not deleted.")
+
+            if not options["keep"]:
+                retained = delete_archived_calls(
+                    path, call_ids, chunk_size=options["chunk_size"]
+                )
+                if retained:
+                    self.stdout.write(
+                        self.style.WARNING(
+                            f"{path}: kept {len(retained)} calls that gained rows "
+                            "after archiving; they will be archived again."
+                        )
+                    )
+
+            segments += 1
+            archived += len(call_ids)
+            self.stdout.write(
+                f"{path}: "
+                + ", ".join(f"{count} {label}" for label, count in counts.items())
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Archived {archived} calls into {segments} segments.")
+        )
@@ -0,0 +1,147 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, transaction
+from django.utils import timezone
+
+from api.models import AgoraToken, Call, CallUser
+from api.sqlite import serialized_write
+
+# Environment for each profile, applied on top of the current environment
+# before settings are loaded in a child process.
+PROFILES = {
+    "default": {"SQLITE_CONCURRENT": "false", "SQLITE_SINGLE_WRITER": "false"},
+    "concurrent": {"SQLITE_CONCURRENT": "true", "SQLITE_SINGLE_WRITER": "false"},
+    "single-writer": {"SQLITE_CONCURRENT": "true", "SQLITE_SINGLE_WRITER": "true"},
+}
+
+
+def join(call_id, user_id):
+    # The writes JoinCallView and its deferred audit task make for a new
+    # participant, done synchronously so the benchmark measures lock contention.
+    with transaction.atomic():
+        CallUser.objects.create(call_id=call_id, user_id=user_id)
+        AgoraToken.objects.create(
+            call_id=call_id,
+            user_id=user_id,
+            token="0" * 139,
+            expiry_time=timezone.now() + timedelta(weeks=52),
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks concurrent call joins against a scratch SQLite database "
+        "under the default, concurrent and single-writer profiles."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=16)
+        parser.add_argument("--joins", type=int, default=2000)
+        parser.add_argument(
+            "--profile",
+            choices=sorted(PROFILES),
+            action="append",
+            help="Profile to run; may be repeated. Defaults to all of them.",
+        )
+        parser.add_argument("--run-profile", help="Internal: run in this process.")
+
+    def handle(self, *args, **options):
+        if options["run_profile"]:
+            result = self.run_profile(options["threads"], options["joins"])
+            self.stdout.write(json.dumps(result))
+            return
+
+        self.stdout.write(
+            f"{'profile':<14} {'joins/s':>9} {'p99 ms':>8} {'locked':>7} {'failed':>7}"
+        )
+        for profile in options["profile"] or PROFILES:
+            result = self.spawn(profile, options["threads"], options["joins"])
+            self.stdout.write(
+                f"{profile:<14} {result['joins_per_second']:>9.0f} "
+                f"{result['p99_ms']:>8.1f} {result['locked']:>7} {result['failed']:>7}"
+            )
+
+    def spawn(self, profile, threads, joins):
+        with tempfile.TemporaryDirectory() as directory:
+            env = {
+                **os.environ,
+                **PROFILES[profile],
+                "SQLITE_PATH": os.path.join(directory, "bench.sqlite3"),
+            }
+            completed = subprocess.run(
+                [
+                    sys.executable,
+                    sys.argv[0],
+                    "bench_sqlite_joins",
+                    f"--run-profile={profile}",
+                    f"--threads={threads}",
+                    f"--joins={joins}",
+                ],
+                env=env,
+                capture_output=True,
+                text=True,
+            )
+        if completed.returncode != 0:
+            raise CommandError(completed.stderr)
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+    def run_profile(self, threads, joins):
+        if connection.vendor != "sqlite":
+            raise CommandError("This benchmark only runs against SQLite.")
+        call_command("migrate", verbosity=0)
+
+        User = get_user_model()
+        User.objects.bulk_create(
+            [User(username=f"bench-{i}") for i in range(joins)], batch_size=500
+        )
+        user_ids = list(User.objects.order_by("pk").values_list("pk", flat=True))
+        call_id = Call.objects.create(status=Call.ONGOING).pk
+
+        latencies = []
+        errors = {"locked": 0, "failed": 0}
+        lock = threading.Lock()
+
+        def worker(ids):
+            for user_id in ids:
+                started = time.perf_counter()
+                try:
+                    Call.objects.get(pk=call_id)
+                    serialized_write(join, call_id, user_id)
+                except OperationalError as e:
+                    key = "locked" if "locked" in str(e) else "failed"
+                    with lock:
+                        errors[key] += 1
+                    continue
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+            connection.close()
+
+        workers = [
+            threading.Thread(target=worker, args=(user_ids[i::threads],))
+            for i in range(threads)
+        ]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else 0
+        return {
+            "joins_per_second": len(latencies) / elapsed,
+            "p99_ms": p99 * 1000,
+            **errors,
+        }
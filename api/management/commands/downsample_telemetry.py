@@ -0,0 +1,66 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from api.models import TelemetryChunk
+from api.telemetry import Series
+
+
+class Command(BaseCommand):
+    help = (
+        "Downsamples the packed samples of telemetry chunks older than --hours "
+        "to one averaged point per --resolution seconds. Chunk aggregates and "
+        "histograms are left untouched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hours", type=int, default=24)
+        parser.add_argument("--resolution", type=int, default=30)
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        resolution_ms = options["resolution"] * 1000
+        if resolution_ms <= 0:
+            raise CommandError("--resolution must be positive.")
+        cutoff = timezone.now() - timedelta(hours=options["hours"])
+
+        chunks = TelemetryChunk.objects.filter(window_start__lt=cutoff).filter(
+            Q(resolution_ms=0) | Q(resolution_ms__lt=resolution_ms)
+        )
+        # Keyset batches rather than one open cursor, since each batch is
+        # rewritten before the next is read. Late samples can still be merged
+        # into these windows by persist_series, so each batch is re-read and
+        # rewritten under the row locks that persist_series also takes.
+        last_pk = 0
+        updated = 0
+        while True:
+            pks = list(
+                chunks.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", flat=True)[: options["batch_size"]]
+            )
+            if not pks:
+                break
+            with transaction.atomic():
+                batch = list(
+                    chunks.select_for_update()
+                    .filter(pk__in=pks)
+                    .only("id", "point_count", "data")
+                )
+                for chunk in batch:
+                    series = Series.unpack(chunk.data, chunk.point_count).downsample(
+                        resolution_ms
+                    )
+                    chunk.data = series.pack()
+                    chunk.point_count = len(series)
+                    chunk.resolution_ms = resolution_ms
+                TelemetryChunk.objects.bulk_update(
+                    batch, ["data", "point_count", "resolution_ms"]
+                )
+            updated += len(batch)
+            last_pk = pks[-1]
+
+        self.stdout.write(self.style.SUCCESS(f"Downsampled {updated} chunks."))
@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.events import prune_events
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes recorded Agora event notifications older than --hours. They "
+        "are only kept to skip redeliveries, which arrive within minutes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hours", type=int, default=settings.AGORA_EVENT_RETENTION_HOURS
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=5000, help="Rows deleted per query."
+        )
+
+    def handle(self, *args, **options):
+        if options["hours"] < 1:
+            raise CommandError("--hours must be at least 1.")
+        cutoff = timezone.now() - timedelta(hours=options["hours"])
+        deleted = prune_events(cutoff, chunk_size=options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} events."))
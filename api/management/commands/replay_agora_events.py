@@ -0,0 +1,59 @@
+import gzip
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.events import EventIngestor, InvalidEvent, parse_event
+
+
+class Command(BaseCommand):
+    help = (
+        "Feeds a recorded file of Agora event notifications (one JSON body per "
+        "line, optionally gzipped) through the ingestion pipeline and reports "
+        "throughput."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--batch-size", type=int)
+        parser.add_argument("--queue-size", type=int)
+
+    def read_events(self, path):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    event = parse_event(json.loads(line))
+                except (ValueError, InvalidEvent) as e:
+                    raise CommandError(f"{path}:{line_number}: {e}")
+                if event is not None:
+                    yield event
+
+    def handle(self, *args, **options):
+        ingestor = EventIngestor(
+            max_queue_size=options["queue_size"], batch_size=options["batch_size"]
+        )
+
+        started = time.perf_counter()
+        for event in self.read_events(options["path"]):
+            ingestor.submit(event, block=True)
+        enqueued = time.perf_counter() - started
+        ingestor.stop()
+        elapsed = time.perf_counter() - started
+
+        stats = ingestor.stats
+        duplicates = stats["received"] - stats["applied"] - stats["deferred"]
+        self.stdout.write(
+            f"Enqueued {stats['received']} events in {enqueued:.2f}s, "
+            f"applied {stats['applied']} ({duplicates} duplicates, "
+            f"{stats['deferred']} deferred after failing) in {elapsed:.2f}s."
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Throughput: {stats['received'] / elapsed if elapsed else 0:.0f} "
+                "events/s"
+            )
+        )
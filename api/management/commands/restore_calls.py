@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from api.archive import ArchiveError, read_manifest, restore_segment, verify_segment
+
+
+class Command(BaseCommand):
+    help = "Restores calls from segment files written by archive_calls."
+
+    def add_arguments(self, parser):
+        parser.add_argument("segments", nargs="+")
+        parser.add_argument(
+            "--batch-size", type=int, default=1000, help="Rows per bulk_create."
+        )
+        parser.add_argument(
+            "--skip-verify",
+            action="store_true",
+            help="Restore without checking the segment against its manifest.",
+        )
+
+    def handle(self, *args, **options):
+        for path in options["segments"]:
+            try:
+                if options["skip_verify"]:
+                    try:
+                        manifest = read_manifest(path)
+                    except ArchiveError:
+                        manifest = {}
+                else:
+                    manifest = verify_segment(path)
+                counts = restore_segment(
+                    path,
+                    batch_size=options["batch_size"],
+                    skip_call_ids=manifest.get("retained_call_ids", []),
+                )
+            except ArchiveError as e:
+                raise CommandError(str(e))
+            except IntegrityError as e:
+                raise CommandError(
+                    f"{path}: rows from this segment already exist ({e}). "
+                    "Nothing from the segment was restored."
+                )
+
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{path}: "
+                    + ", ".join(f"{count} {label}" for label, count in counts.items())
+                )
+            )
@@ -0,0 +1,55 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api.tasks import claim_tasks, run_deferred_task
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs tasks from the durable DeferredTask queue. On SIGINT or SIGTERM "
+        "the current batch is finished before exiting."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="Seconds to sleep when no tasks are due.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once no tasks are due instead of polling.",
+        )
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+
+        succeeded = failed = 0
+        while not self.stopping:
+            close_old_connections()
+            tasks = claim_tasks(options["batch_size"])
+            if not tasks:
+                if options["once"]:
+                    break
+                time.sleep(options["poll_interval"])
+                continue
+            for deferred in tasks:
+                if run_deferred_task(deferred):
+                    succeeded += 1
+                else:
+                    failed += 1
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Ran {succeeded} tasks, {failed} failed.")
+        )
+
+    def request_stop(self, signum, frame):
+        self.stopping = True
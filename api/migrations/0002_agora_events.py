@@ -0,0 +1,43 @@
+# Generated by Django 5.2 on 2026-10-19 18:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AgoraEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("notice_id", models.CharField(max_length=64, unique=True)),
+                ("event_type", models.PositiveSmallIntegerField()),
+                ("channel_id", models.CharField(db_index=True, max_length=64)),
+                ("uid", models.BigIntegerField(blank=True, null=True)),
+                ("occurred_at", models.DateTimeField()),
+                ("received_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="calluser",
+            name="joined_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="calluser",
+            name="left_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
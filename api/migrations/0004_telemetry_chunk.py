@@ -0,0 +1,76 @@
+# Generated by Django 5.2 on 2026-10-19 18:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0003_deferred_task"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TelemetryChunk",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("window_start", models.DateTimeField()),
+                ("resolution_ms", models.PositiveIntegerField(default=0)),
+                ("sample_count", models.PositiveIntegerField()),
+                ("point_count", models.PositiveIntegerField()),
+                ("data", models.BinaryField()),
+                ("histograms", models.BinaryField()),
+                ("bitrate_sum", models.FloatField()),
+                ("bitrate_min", models.FloatField()),
+                ("bitrate_max", models.FloatField()),
+                ("packet_loss_sum", models.FloatField()),
+                ("packet_loss_min", models.FloatField()),
+                ("packet_loss_max", models.FloatField()),
+                ("rtt_sum", models.FloatField()),
+                ("rtt_min", models.FloatField()),
+                ("rtt_max", models.FloatField()),
+                ("frame_rate_sum", models.FloatField()),
+                ("frame_rate_min", models.FloatField()),
+                ("frame_rate_max", models.FloatField()),
+                (
+                    "call",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="telemetry_chunks",
+                        to="api.call",
+                    ),
+                ),
+                (
+                    "call_user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="telemetry_chunks",
+                        to="api.calluser",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["call", "window_start"],
+                        name="api_telemet_call_id_788922_idx",
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("call_user", "window_start"),
+                        name="unique_telemetry_window",
+                    )
+                ],
+            },
+        ),
+    ]
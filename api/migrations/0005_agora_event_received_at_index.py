@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 19:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0004_telemetry_chunk"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="agoraevent",
+            name="received_at",
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
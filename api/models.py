@@ -1,7 +1,9 @@
 import uuid
 
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.utils import timezone
 
 
 class Call(models.Model):
@@ -54,6 +56,8 @@ class CallUser(models.Model):
         settings.AUTH_USER_MODEL, related_name="calls", on_delete=models.CASCADE
     )
     role = models.CharField(max_length=50, choices=ROLE_CHOICES, default=AUDIENCE)
+    joined_at = models.DateTimeField(null=True, blank=True)
+    left_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return f"User {self.user.username} in Call {self.call.call_id} as {self.role}"
@@ -111,3 +115,97 @@ class AgoraToken(models.Model):
 
     def __str__(self):
         return f"Token for User {self.user.username} in Call {self.call.call_id}"
+
+
+class AgoraEvent(models.Model):
+    """
+    A channel event notification received from Agora. `notice_id` is unique so
+    redelivered notifications are applied only once; rows older than Agora's
+    redelivery window are removed by the `prune_agora_events` command.
+    """
+
+    notice_id = models.CharField(max_length=64, unique=True)
+    event_type = models.PositiveSmallIntegerField()
+    channel_id = models.CharField(max_length=64, db_index=True)
+    uid = models.BigIntegerField(null=True, blank=True)
+    occurred_at = models.DateTimeField()
+    received_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"Event {self.event_type} in channel {self.channel_id}"
+
+
+class DeferredTask(models.Model):
+    """
+    A task queued for the `run_task_worker` command when the durable task
+    queue is enabled. Rows are deleted once the task succeeds.
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (FAILED, "Failed"),
+    ]
+
+    name = models.CharField(max_length=200)
+    args = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+    kwargs = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "run_after"])]
+
+    def __str__(self):
+        return f"Task {self.name} ({self.status})"
+
+
+class TelemetryChunk(models.Model):
+    """
+    Quality samples reported by one participant during one time window, packed
+    as little-endian arrays in `data`. The summary columns and `histograms`
+    describe every sample received, so they stay exact after `data` has been
+    downsampled to `resolution_ms`.
+    """
+
+    call = models.ForeignKey(
+        Call, related_name="telemetry_chunks", on_delete=models.CASCADE
+    )
+    call_user = models.ForeignKey(
+        CallUser, related_name="telemetry_chunks", on_delete=models.CASCADE
+    )
+    window_start = models.DateTimeField()
+    resolution_ms = models.PositiveIntegerField(default=0)  # 0 means raw samples
+    sample_count = models.PositiveIntegerField()
+    point_count = models.PositiveIntegerField()
+    data = models.BinaryField()
+    histograms = models.BinaryField()
+    bitrate_sum = models.FloatField()
+    bitrate_min = models.FloatField()
+    bitrate_max = models.FloatField()
+    packet_loss_sum = models.FloatField()
+    packet_loss_min = models.FloatField()
+    packet_loss_max = models.FloatField()
+    rtt_sum = models.FloatField()
+    rtt_min = models.FloatField()
+    rtt_max = models.FloatField()
+    frame_rate_sum = models.FloatField()
+    frame_rate_min = models.FloatField()
+    frame_rate_max = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["call_user", "window_start"], name="unique_telemetry_window"
+            )
+        ]
+        indexes = [models.Index(fields=["call", "window_start"])]
+
+    def __str__(self):
+        return f"Telemetry for CallUser {self.call_user_id} at {self.window_start}"
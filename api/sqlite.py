@@ -0,0 +1,77 @@
+import queue
+import threading
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+
+_writer = None
+_writer_lock = threading.Lock()
+_state = threading.local()
+
+
+class _Writer:
+    # A plain daemon thread rather than a ThreadPoolExecutor: the interpreter
+    # shuts executors down before atexit handlers run, and the task, event and
+    # telemetry drains at exit all write through this thread.
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(
+            target=self._run, name="sqlite-writer", daemon=True
+        )
+        self.thread.start()
+
+    def submit(self, func, args, kwargs):
+        future = Future()
+        self.queue.put((future, func, args, kwargs))
+        return future
+
+    def _run(self):
+        # The connection is kept open across writes rather than recycled per
+        # request, so the init_command PRAGMAs run once; it is only reopened
+        # when it is no longer usable or a write failed in the database.
+        _state.in_writer = True
+        while True:
+            future, func, args, kwargs = self.queue.get()
+            if connection.connection is not None and not connection.is_usable():
+                connection.close()
+            try:
+                future.set_result(func(*args, **kwargs))
+            except DatabaseError as e:
+                connection.close()
+                future.set_exception(e)
+            except BaseException as e:
+                future.set_exception(e)
+
+
+def _get_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.thread.is_alive():
+            try:
+                _writer = _Writer()
+            except RuntimeError:
+                # Threads can no longer be started during interpreter shutdown.
+                return None
+        return _writer
+
+
+def serialized_write(func, *args, **kwargs):
+    """
+    Calls `func` on the single writer thread when `SQLITE_SINGLE_WRITER` is
+    enabled and returns its result, so concurrent requests queue in-process
+    instead of contending for SQLite's write lock. Calls made from the writer
+    thread itself, from inside an atomic block whose locks the writer would
+    wait on, or once the writer thread can no longer run, happen directly.
+    """
+    if (
+        not settings.SQLITE_SINGLE_WRITER
+        or getattr(_state, "in_writer", False)
+        or connection.in_atomic_block
+    ):
+        return func(*args, **kwargs)
+    writer = _get_writer()
+    if writer is None:
+        return func(*args, **kwargs)
+    return writer.submit(func, args, kwargs).result()
@@ -0,0 +1,249 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import AgoraToken, DeferredTask
+from .sqlite import serialized_write
+
+logger = logging.getLogger(__name__)
+
+# Number of recent task latencies kept for percentile reporting.
+LATENCY_SAMPLES = 1000
+
+registry = {}
+
+
+def task(func):
+    """
+    Registers `func` so it can be deferred by name through the durable queue.
+    Task arguments must be JSON serializable, so pass ids rather than models.
+    """
+    func.task_name = f"{func.__module__}.{func.__name__}"
+    registry[func.task_name] = func
+    return func
+
+
+def _run_with_retries(func, args, kwargs):
+    for attempt in range(settings.TASK_MAX_RETRIES + 1):
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            if attempt == settings.TASK_MAX_RETRIES:
+                raise
+            logger.warning("Retrying task %s", func.task_name, exc_info=True)
+            time.sleep(settings.TASK_RETRY_DELAY * 2**attempt)
+
+
+def _percentile(samples, percent):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+class TaskExecutor:
+    """
+    Runs deferred tasks on a small pool of threads fed by a bounded queue.
+    When the queue stays full for `TASK_SUBMIT_TIMEOUT` seconds the task runs
+    in the caller's thread instead, so a backlog slows requests down rather
+    than dropping writes.
+    """
+
+    def __init__(self, workers=None, max_queue_size=None):
+        self.workers = workers or settings.TASK_WORKERS
+        self.queue = queue.Queue(maxsize=max_queue_size or settings.TASK_QUEUE_SIZE)
+        self.stats = {"submitted": 0, "inline": 0, "completed": 0, "failed": 0}
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def _record(self, key, latency=None):
+        with self._lock:
+            self.stats[key] += 1
+            if latency is not None:
+                self.latencies.append(latency)
+
+    def start(self):
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            if self._threads:
+                return
+            self._stopping.clear()
+            for number in range(self.workers):
+                thread = threading.Thread(
+                    target=self._run, name=f"task-worker-{number}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """
+        Stops the workers once the queued tasks have run, waiting at most
+        `timeout` seconds in total.
+        """
+        self._stopping.set()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            remaining = (
+                None if deadline is None else max(0, deadline - time.monotonic())
+            )
+            thread.join(remaining)
+
+    def submit(self, func, *args, **kwargs):
+        self.start()
+        try:
+            self.queue.put(
+                (func, args, kwargs, time.monotonic()),
+                timeout=settings.TASK_SUBMIT_TIMEOUT,
+            )
+        except queue.Full:
+            self._record("inline")
+            self._execute(func, args, kwargs, time.monotonic())
+            return
+        self._record("submitted")
+
+    def _execute(self, func, args, kwargs, enqueued_at):
+        try:
+            _run_with_retries(func, args, kwargs)
+        except Exception:
+            logger.exception("Task %s failed", func.task_name)
+            self._record("failed", time.monotonic() - enqueued_at)
+        else:
+            self._record("completed", time.monotonic() - enqueued_at)
+
+    def _run(self):
+        try:
+            while not (self._stopping.is_set() and self.queue.empty()):
+                try:
+                    func, args, kwargs, enqueued_at = self.queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                close_old_connections()
+                self._execute(func, args, kwargs, enqueued_at)
+        finally:
+            connection.close()
+
+    def snapshot(self):
+        with self._lock:
+            latencies = list(self.latencies)
+            stats = dict(self.stats)
+        return {
+            **stats,
+            "queue_depth": self.queue.qsize(),
+            "latency_p50": _percentile(latencies, 50),
+            "latency_p99": _percentile(latencies, 99),
+        }
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = TaskExecutor()
+            atexit.register(_executor.stop, settings.TASK_DRAIN_TIMEOUT)
+        return _executor
+
+
+def defer(func, *args, **kwargs):
+    """
+    Runs a registered task off the request path, either on the in-process
+    executor or, with `TASK_QUEUE_DURABLE`, through the `DeferredTask` table.
+    """
+    if settings.TASK_QUEUE_DURABLE:
+        DeferredTask.objects.create(name=func.task_name, args=args, kwargs=kwargs)
+    else:
+        get_executor().submit(func, *args, **kwargs)
+
+
+def claim_tasks(limit):
+    """
+    Claims up to `limit` due tasks and returns them. Due tasks are pending rows
+    whose `run_after` has passed and running rows whose lease has expired, left
+    behind by a worker that died. Each row is claimed with an UPDATE guarded on
+    the status and attempt count that were read, so when several workers poll
+    the same table (SQLite has no SKIP LOCKED) only one of them wins a row.
+    """
+    now = timezone.now()
+    lease_expiry = now + timedelta(seconds=settings.TASK_LEASE_SECONDS)
+    claimed = []
+    with transaction.atomic():
+        due = DeferredTask.objects.filter(
+            status__in=[DeferredTask.PENDING, DeferredTask.RUNNING],
+            run_after__lte=now,
+        ).order_by("pk")
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        for deferred in due[:limit]:
+            won = DeferredTask.objects.filter(
+                pk=deferred.pk, status=deferred.status, attempts=deferred.attempts
+            ).update(
+                status=DeferredTask.RUNNING,
+                attempts=F("attempts") + 1,
+                run_after=lease_expiry,
+            )
+            if won:
+                deferred.status = DeferredTask.RUNNING
+                deferred.attempts += 1
+                deferred.run_after = lease_expiry
+                claimed.append(deferred)
+    return claimed
+
+
+def run_deferred_task(deferred):
+    """
+    Runs a `DeferredTask` returned by `claim_tasks`, deleting it on success and
+    rescheduling it with exponential backoff on failure until
+    `TASK_MAX_RETRIES` is reached. Only functions registered with `@task` are
+    run; a row naming anything else is marked failed. The final update is
+    skipped if the lease ran out and another worker has claimed the row since.
+    """
+    owned = DeferredTask.objects.filter(pk=deferred.pk, attempts=deferred.attempts)
+    func = registry.get(deferred.name)
+    if func is None:
+        logger.error("Unknown deferred task %s", deferred.name)
+        owned.update(
+            status=DeferredTask.FAILED,
+            run_after=timezone.now(),
+            last_error=f"Unknown task {deferred.name!r}.",
+        )
+        return False
+    try:
+        func(*deferred.args, **deferred.kwargs)
+    except Exception as e:
+        logger.exception("Deferred task %s failed", deferred.name)
+        if deferred.attempts > settings.TASK_MAX_RETRIES:
+            status, run_after = DeferredTask.FAILED, timezone.now()
+        else:
+            status = DeferredTask.PENDING
+            run_after = timezone.now() + timedelta(
+                seconds=settings.TASK_RETRY_DELAY * 2 ** (deferred.attempts - 1)
+            )
+        owned.update(status=status, run_after=run_after, last_error=repr(e))
+        return False
+    owned.delete()
+    return True
+
+
+@task
+def record_agora_token(call_id, user_id, token, expiry_time):
+    serialized_write(
+        AgoraToken.objects.create,
+        call_id=call_id,
+        user_id=user_id,
+        token=token,
+        expiry_time=expiry_time,
+    )
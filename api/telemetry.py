@@ -0,0 +1,436 @@
+import atexit
+import logging
+import math
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Max, Min, Sum
+
+from .models import TelemetryChunk
+from .sqlite import serialized_write
+from .tasks import task
+
+logger = logging.getLogger(__name__)
+
+METRICS = ("bitrate", "packet_loss", "rtt", "frame_rate")
+
+# Histogram bucket lower edges per metric. Percentiles are estimated from these
+# counts, so aggregates never need the packed samples.
+HISTOGRAM_EDGES = {
+    "bitrate": (0, 50, 100, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000, 8000),
+    "packet_loss": (0, 0.5, 1, 2, 3, 5, 8, 10, 15, 20, 30, 50),
+    "rtt": (0, 20, 50, 80, 100, 150, 200, 300, 400, 600, 1000, 2000),
+    "frame_rate": (0, 5, 10, 15, 20, 24, 25, 30, 45, 60),
+}
+
+PERCENTILES = (50, 95, 99)
+
+# Samples are stored as float32, so larger values would be packed as infinity.
+FLOAT32_MAX = 3.4028234663852886e38
+
+
+class InvalidSample(ValueError):
+    pass
+
+
+def _to_bytes(values):
+    # Chunks are always stored little-endian.
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_bytes(typecode, data):
+    values = array(typecode)
+    values.frombytes(bytes(data))
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+class Series:
+    """
+    Column-oriented samples for one participant and window: millisecond offsets
+    from the window start plus one float32 array per metric.
+    """
+
+    __slots__ = ("offsets", "columns")
+
+    def __init__(self):
+        self.offsets = array("I")
+        self.columns = {metric: array("f") for metric in METRICS}
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def append(self, offset_ms, values):
+        self.offsets.append(offset_ms)
+        for metric, value in zip(METRICS, values):
+            self.columns[metric].append(value)
+
+    def extend(self, other):
+        self.offsets.extend(other.offsets)
+        for metric in METRICS:
+            self.columns[metric].extend(other.columns[metric])
+
+    def pack(self):
+        return _to_bytes(self.offsets) + b"".join(
+            _to_bytes(self.columns[metric]) for metric in METRICS
+        )
+
+    @classmethod
+    def unpack(cls, data, count):
+        series = cls()
+        size = count * 4
+        series.offsets = _from_bytes("I", data[:size])
+        for i, metric in enumerate(METRICS, start=1):
+            series.columns[metric] = _from_bytes("f", data[i * size : (i + 1) * size])
+        return series
+
+    def downsample(self, resolution_ms, weights=None):
+        """
+        Returns a new series holding the mean of each `resolution_ms` bucket.
+        `weights` optionally gives the number of samples each point stands for.
+        """
+        buckets = {}
+        for i, offset in enumerate(self.offsets):
+            weight = weights[i] if weights is not None else 1
+            bucket = buckets.setdefault(offset - offset % resolution_ms, [0] * 5)
+            bucket[0] += weight
+            for j, metric in enumerate(METRICS, start=1):
+                bucket[j] += self.columns[metric][i] * weight
+
+        result = Series()
+        for offset in sorted(buckets):
+            count, *sums = buckets[offset]
+            result.append(offset, [total / count for total in sums])
+        return result
+
+    def summary(self):
+        """
+        Returns the per-metric sum/min/max fields and packed histograms stored
+        alongside a chunk.
+        """
+        fields = {"sample_count": len(self)}
+        histograms = array("I")
+        for metric in METRICS:
+            values = self.columns[metric]
+            edges = HISTOGRAM_EDGES[metric]
+            counts = array("I", [0] * len(edges))
+            for value in values:
+                counts[bisect_right(edges, value) - 1] += 1
+            histograms.extend(counts)
+            fields[f"{metric}_sum"] = sum(values)
+            fields[f"{metric}_min"] = min(values)
+            fields[f"{metric}_max"] = max(values)
+        fields["histograms"] = _to_bytes(histograms)
+        return fields
+
+
+def _merge_summaries(chunk, summary):
+    chunk.sample_count += summary["sample_count"]
+    for metric in METRICS:
+        setattr(
+            chunk,
+            f"{metric}_sum",
+            getattr(chunk, f"{metric}_sum") + summary[f"{metric}_sum"],
+        )
+        setattr(
+            chunk,
+            f"{metric}_min",
+            min(getattr(chunk, f"{metric}_min"), summary[f"{metric}_min"]),
+        )
+        setattr(
+            chunk,
+            f"{metric}_max",
+            max(getattr(chunk, f"{metric}_max"), summary[f"{metric}_max"]),
+        )
+    merged = _from_bytes("I", chunk.histograms)
+    for i, count in enumerate(_from_bytes("I", summary["histograms"])):
+        merged[i] += count
+    chunk.histograms = _to_bytes(merged)
+
+
+def parse_samples(samples):
+    """
+    Validates uploaded samples and returns `(ts_ms, values)` tuples, where
+    `values` follows the order of `METRICS`.
+    """
+    if not isinstance(samples, list) or not samples:
+        raise InvalidSample("samples must be a non-empty list.")
+    if len(samples) > settings.TELEMETRY_MAX_SAMPLES:
+        raise InvalidSample(
+            f"At most {settings.TELEMETRY_MAX_SAMPLES} samples per upload."
+        )
+
+    # Far-future windows would never close, and timestamps far outside this
+    # range cannot be turned into datetimes when flushed.
+    now_ms = int(time.time() * 1000)
+    earliest = now_ms - settings.TELEMETRY_MAX_SAMPLE_AGE * 1000
+    latest = now_ms + settings.TELEMETRY_MAX_CLOCK_SKEW * 1000
+
+    parsed = []
+    for sample in samples:
+        try:
+            ts = int(sample["ts"])
+            values = [float(sample[metric]) for metric in METRICS]
+        except (KeyError, TypeError, ValueError, OverflowError):
+            raise InvalidSample(
+                f"Each sample needs an integer ts and numeric {', '.join(METRICS)}."
+            )
+        if not earliest <= ts <= latest:
+            raise InvalidSample(
+                "Sample ts must be a millisecond timestamp close to the current time."
+            )
+        if not all(
+            math.isfinite(value) and 0 <= value <= FLOAT32_MAX for value in values
+        ):
+            raise InvalidSample(
+                "Sample values must be finite, non-negative float32 numbers."
+            )
+        parsed.append((ts, values))
+    return parsed
+
+
+def persist_series(call_id, call_user_id, window_start_ms, series):
+    """
+    Writes a buffered series as the participant's chunk for the window,
+    merging into the existing row when one was already flushed.
+    """
+    window_start = datetime.fromtimestamp(window_start_ms / 1000, tz=timezone.utc)
+    summary = series.summary()
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                chunk = (
+                    TelemetryChunk.objects.select_for_update()
+                    .filter(call_user_id=call_user_id, window_start=window_start)
+                    .first()
+                )
+                if chunk is None:
+                    TelemetryChunk.objects.create(
+                        call_id=call_id,
+                        call_user_id=call_user_id,
+                        window_start=window_start,
+                        point_count=len(series),
+                        data=series.pack(),
+                        **summary,
+                    )
+                    return
+
+                stored = Series.unpack(chunk.data, chunk.point_count)
+                if chunk.resolution_ms:
+                    # Stored points are bucket means. Per-bucket counts are not
+                    # kept, so each stands for the chunk's average bucket size.
+                    weight = chunk.sample_count / chunk.point_count
+                    weights = [weight] * len(stored) + [1] * len(series)
+                    stored.extend(series)
+                    stored = stored.downsample(chunk.resolution_ms, weights)
+                else:
+                    stored.extend(series)
+                _merge_summaries(chunk, summary)
+                chunk.point_count = len(stored)
+                chunk.data = stored.pack()
+                chunk.save()
+                return
+        except IntegrityError:
+            # Another process created the window's row first; merge into it.
+            if attempt:
+                raise
+
+
+class TelemetryBuffer:
+    """
+    Accumulates uploaded samples in memory, keyed by call and then by
+    participant and window, until the window closes and is flushed.
+    """
+
+    def __init__(self, window_seconds=None, flush_grace=None):
+        self.window_ms = int(
+            (window_seconds or settings.TELEMETRY_WINDOW_SECONDS) * 1000
+        )
+        self.flush_grace_ms = int(
+            (flush_grace or settings.TELEMETRY_FLUSH_GRACE) * 1000
+        )
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._next_flush = 0.0
+
+    def flush_due(self):
+        """
+        Returns True at most once per flush grace period, so uploads schedule
+        one flush of closed windows rather than one each.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_flush:
+                return False
+            self._next_flush = now + self.flush_grace_ms / 1000
+            return True
+
+    def add(self, call_id, call_user_id, samples):
+        with self._lock:
+            windows = self._calls.setdefault(call_id, {})
+            for ts, values in samples:
+                window_start = ts - ts % self.window_ms
+                series = windows.get((call_user_id, window_start))
+                if series is None:
+                    series = windows[(call_user_id, window_start)] = Series()
+                series.append(ts - window_start, values)
+
+    def _take(self, call_id=None, before_ms=None):
+        taken = []
+        with self._lock:
+            call_ids = [call_id] if call_id is not None else list(self._calls)
+            for current in call_ids:
+                windows = self._calls.get(current, {})
+                for key in list(windows):
+                    if before_ms is None or key[1] < before_ms:
+                        taken.append((current, *key, windows.pop(key)))
+                if not windows:
+                    self._calls.pop(current, None)
+        return taken
+
+    def _put_back(self, call_id, call_user_id, window_start, series):
+        # Samples added to the window since it was taken go after the older
+        # ones, so the next flush writes them together.
+        with self._lock:
+            windows = self._calls.setdefault(call_id, {})
+            newer = windows.get((call_user_id, window_start))
+            if newer is not None:
+                series.extend(newer)
+            windows[(call_user_id, window_start)] = series
+
+    def flush(self, call_id=None, force=False):
+        """
+        Persists closed windows, or every buffered window when `force` is set.
+        Windows that fail to persist are put back and retried by the next
+        flush. Returns the number of chunks written.
+        """
+        before_ms = None
+        if not force:
+            before_ms = int(time.time() * 1000) - self.window_ms - self.flush_grace_ms
+        written = 0
+        for item in self._take(call_id, before_ms):
+            try:
+                serialized_write(persist_series, *item)
+                written += 1
+            except Exception:
+                logger.exception("Failed to persist telemetry for call %s", item[0])
+                self._put_back(*item)
+        return written
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = TelemetryBuffer()
+            atexit.register(_buffer.flush, force=True)
+        return _buffer
+
+
+@task
+def flush_telemetry():
+    get_buffer().flush()
+
+
+def _percentile(edges, counts, total, percent, low, high):
+    # Linear interpolation inside the bucket holding the requested rank,
+    # bounded by the observed min and max.
+    rank = total * percent / 100
+    seen = 0
+    for i, count in enumerate(counts):
+        if count and seen + count >= rank:
+            start = max(edges[i], low)
+            end = min(edges[i + 1] if i + 1 < len(edges) else high, high)
+            return start + (end - start) * (rank - seen) / count
+        seen += count
+    return high
+
+
+def _metric_summary(metric, row, counts):
+    total = row["samples"]
+    if not total:
+        return None
+    low, high = row[f"{metric}_min"], row[f"{metric}_max"]
+    summary = {
+        "mean": row[f"{metric}_sum"] / total,
+        "min": low,
+        "max": high,
+    }
+    for percent in PERCENTILES:
+        summary[f"p{percent}"] = _percentile(
+            HISTOGRAM_EDGES[metric], counts, total, percent, low, high
+        )
+    return summary
+
+
+def summarize_call(call):
+    """
+    Returns per-participant and call-wide aggregates and percentile estimates,
+    computed from the stored chunk statistics and histograms only.
+    """
+    aggregates = {"samples": Sum("sample_count")}
+    for metric in METRICS:
+        aggregates[f"{metric}_sum"] = Sum(f"{metric}_sum")
+        aggregates[f"{metric}_min"] = Min(f"{metric}_min")
+        aggregates[f"{metric}_max"] = Max(f"{metric}_max")
+
+    chunks = TelemetryChunk.objects.filter(call=call)
+    rows = {
+        row["call_user_id"]: row
+        for row in chunks.values("call_user_id", "call_user__user__username")
+        .annotate(
+            first_window=Min("window_start"),
+            last_window=Max("window_start"),
+            **aggregates,
+        )
+        .order_by("call_user_id")
+    }
+    overall = chunks.aggregate(**aggregates)
+
+    size = sum(len(edges) for edges in HISTOGRAM_EDGES.values())
+    histograms = {call_user_id: array("I", [0] * size) for call_user_id in rows}
+    totals = array("I", [0] * size)
+    for call_user_id, blob in chunks.values_list(
+        "call_user_id", "histograms"
+    ).iterator():
+        for i, count in enumerate(_from_bytes("I", blob)):
+            histograms[call_user_id][i] += count
+            totals[i] += count
+
+    def metrics(row, counts):
+        result = {}
+        start = 0
+        for metric in METRICS:
+            end = start + len(HISTOGRAM_EDGES[metric])
+            result[metric] = _metric_summary(metric, row, counts[start:end])
+            start = end
+        return result
+
+    return {
+        "samples": overall["samples"] or 0,
+        "metrics": metrics(overall, totals),
+        "participants": [
+            {
+                "user": row["call_user__user__username"],
+                "samples": row["samples"],
+                "first_window": row["first_window"],
+                "last_window": row["last_window"],
+                "metrics": metrics(row, histograms[call_user_id]),
+            }
+            for call_user_id, row in rows.items()
+        ],
+    }
@@ -1,3 +1,690 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from contextlib import closing
+from io import StringIO
+from unittest import mock
+import shutil
+import tempfile
+from datetime import timedelta
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .archive import (
+    ArchiveError,
+    archivable_calls,
+    delete_archived_calls,
+    read_manifest,
+    restore_segment,
+    verify_segment,
+    write_segment,
+)
+from . import events, telemetry
+from .models import (
+    AgoraEvent,
+    AgoraToken,
+    Call,
+    CallUser,
+    DeferredTask,
+    Message,
+    TelemetryChunk,
+)
+from .telemetry import Series, TelemetryBuffer
+from .tasks import (
+    TaskExecutor,
+    claim_tasks,
+    record_agora_token,
+    registry,
+    run_deferred_task,
+    task,
+)
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.user = get_user_model().objects.create(username="archiver")
+        ended = timezone.now() - timedelta(days=100)
+        self.calls = []
+        for status in [Call.COMPLETED, Call.CANCELLED, Call.ONGOING]:
+            call = Call.objects.create(status=status, end_time=ended)
+            CallUser.objects.create(call=call, user=self.user)
+            Message.objects.create(call=call, sender=self.user, content="hi")
+            AgoraToken.objects.create(
+                call=call, user=self.user, token="t", expiry_time=ended
+            )
+            self.calls.append(call)
+        self.path = os.path.join(self.directory, "calls-00001.jsonl.gz")
+
+    def archive(self):
+        call_ids = list(
+            archivable_calls(30).order_by("pk").values_list("pk", flat=True)
+        )
+        counts = write_segment(self.path, call_ids)
+        verify_segment(self.path, expected_counts=counts)
+        return call_ids, counts
+
+    def test_round_trip(self):
+        original = Message.objects.get(call=self.calls[0])
+        call_ids, counts = self.archive()
+        self.assertEqual(call_ids, [self.calls[0].pk, self.calls[1].pk])
+        self.assertEqual(counts["api.message"], 2)
+
+        self.assertEqual(delete_archived_calls(self.path, call_ids), [])
+        self.assertEqual(
+            list(Call.objects.values_list("pk", flat=True)), [self.calls[2].pk]
+        )
+        self.assertEqual(Message.objects.count(), 1)
+
+        restored = restore_segment(self.path, batch_size=2)
+        self.assertEqual(restored, counts)
+        self.assertEqual(Call.objects.count(), 3)
+        message = Message.objects.get(call=self.calls[0])
+        self.assertEqual(message.timestamp, original.timestamp)
+        self.assertEqual(message.content, "hi")
+
+    def test_checksum_mismatch(self):
+        self.archive()
+        with open(self.path, "ab") as f:
+            f.write(b"tampered")
+        with self.assertRaises(ArchiveError):
+            verify_segment(self.path)
+
+    def test_rows_added_after_archiving_are_kept(self):
+        call_ids, _ = self.archive()
+        late = AgoraToken.objects.create(
+            call=self.calls[0], user=self.user, token="late", expiry_time=timezone.now()
+        )
+
+        retained = delete_archived_calls(self.path, call_ids)
+
+        self.assertEqual(retained, [self.calls[0].pk])
+        self.assertTrue(AgoraToken.objects.filter(pk=late.pk).exists())
+        self.assertFalse(Call.objects.filter(pk=self.calls[1].pk).exists())
+        self.assertEqual(read_manifest(self.path)["retained_call_ids"], retained)
+
+        # Restoring skips the retained call, which is still in the database.
+        call_command("restore_calls", self.path, stdout=StringIO())
+        self.assertTrue(Call.objects.filter(pk=self.calls[1].pk).exists())
+
+    def test_rows_replaced_after_archiving_are_kept(self):
+        call_ids, _ = self.archive()
+        # Same number of tokens as archived, but a different row.
+        AgoraToken.objects.filter(call=self.calls[0]).delete()
+        late = AgoraToken.objects.create(
+            call=self.calls[0], user=self.user, token="late", expiry_time=timezone.now()
+        )
+
+        retained = delete_archived_calls(self.path, call_ids)
+
+        self.assertEqual(retained, [self.calls[0].pk])
+        self.assertTrue(AgoraToken.objects.filter(pk=late.pk).exists())
+
+    def test_restore_existing_rows_raises_command_error(self):
+        self.archive()
+        with self.assertRaises(CommandError):
+            call_command("restore_calls", self.path, stdout=StringIO())
+        self.assertEqual(Call.objects.count(), 3)
+
+
+def agora_event(notice_id, event_type, channel_id, ts, uid=None):
+    payload = {"channelName": channel_id, "ts": ts}
+    if uid is not None:
+        payload["uid"] = uid
+    return {"noticeId": notice_id, "eventType": event_type, "payload": payload}
+
+
+@override_settings(AGORA_APP_CERTIFICATE="certificate")
+class AgoraEventViewTests(TestCase):
+    url = "/api/v1/agora-events/"
+
+    def post(self, body, **headers):
+        return self.client.post(
+            self.url, body, content_type="application/json", headers=headers
+        )
+
+    def sign(self, body):
+        return hmac.new(b"certificate", body, hashlib.sha256).hexdigest()
+
+    @mock.patch("api.views.get_ingestor")
+    def test_rejects_bad_signature(self, get_ingestor):
+        body = json.dumps(agora_event("n1", events.CHANNEL_CREATE, "abc", 1)).encode()
+        self.assertEqual(self.post(body).status_code, 401)
+        self.assertEqual(
+            self.post(body, **{"Agora-Signature-V2": "0" * 64}).status_code, 401
+        )
+        with override_settings(AGORA_APP_CERTIFICATE=None):
+            response = self.post(body, **{"Agora-Signature-V2": self.sign(body)})
+        self.assertEqual(response.status_code, 401)
+        get_ingestor.return_value.submit.assert_not_called()
+
+    @mock.patch("api.views.get_ingestor")
+    def test_accepts_signed_event(self, get_ingestor):
+        body = json.dumps(agora_event("n1", events.CHANNEL_CREATE, "abc", 1)).encode()
+        response = self.post(body, **{"Agora-Signature-V2": self.sign(body)})
+        self.assertEqual(response.status_code, 200)
+        event = get_ingestor.return_value.submit.call_args.args[0]
+        self.assertEqual(event.notice_id, "n1")
+
+    @mock.patch("api.views.get_ingestor")
+    def test_malformed_timestamps_are_bad_requests(self, get_ingestor):
+        for ts in ["abc", None, 10**20]:
+            body = json.dumps(
+                agora_event("n1", events.CHANNEL_CREATE, "abc", ts)
+            ).encode()
+            response = self.post(body, **{"Agora-Signature-V2": self.sign(body)})
+            self.assertEqual(response.status_code, 400)
+
+
+class ApplyEventsTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.host = User.objects.create(username="host")
+        self.guest = User.objects.create(username="guest")
+        self.call = Call.objects.create()
+        CallUser.objects.create(call=self.call, user=self.host, role=CallUser.HOST)
+        CallUser.objects.create(call=self.call, user=self.guest)
+
+    def parse(self, *args, **kwargs):
+        return events.parse_event(agora_event(*args, **kwargs))
+
+    def test_updates_call_and_participants(self):
+        channel = self.call.channel_id
+        applied = events.apply_events(
+            [
+                self.parse("1", events.CHANNEL_CREATE, channel, 1000),
+                self.parse("2", events.BROADCASTER_JOIN, channel, 1010, self.host.pk),
+                self.parse("3", events.AUDIENCE_JOIN, channel, 1020, self.guest.pk),
+                self.parse(
+                    "4", events.ROLE_TO_BROADCASTER, channel, 1030, self.guest.pk
+                ),
+                self.parse("5", events.BROADCASTER_LEAVE, channel, 1040, self.host.pk),
+                self.parse("6", events.CHANNEL_DESTROY, channel, 1050),
+            ]
+        )
+
+        self.assertEqual(applied, 6)
+        self.call.refresh_from_db()
+        self.assertEqual(self.call.status, Call.COMPLETED)
+        self.assertEqual(self.call.start_time.timestamp(), 1000)
+        self.assertEqual(self.call.end_time.timestamp(), 1050)
+        host = CallUser.objects.get(user=self.host)
+        self.assertEqual(host.joined_at.timestamp(), 1010)
+        self.assertEqual(host.left_at.timestamp(), 1040)
+        guest = CallUser.objects.get(user=self.guest)
+        self.assertEqual(guest.joined_at.timestamp(), 1020)
+        self.assertIsNone(guest.left_at)
+        self.assertEqual(guest.role, CallUser.HOST)
+
+    def test_deduplicates_by_notice_id(self):
+        channel = self.call.channel_id
+        join = self.parse("1", events.AUDIENCE_JOIN, channel, 1000, self.guest.pk)
+        self.assertEqual(events.apply_events([join, join]), 1)
+
+        # A redelivery of an already applied leave must not overwrite a rejoin.
+        leave = self.parse("2", events.AUDIENCE_LEAVE, channel, 1010, self.guest.pk)
+        events.apply_events([leave])
+        rejoin = self.parse("3", events.AUDIENCE_JOIN, channel, 1020, self.guest.pk)
+        events.apply_events([rejoin])
+        self.assertEqual(events.apply_events([leave]), 0)
+
+        self.assertEqual(AgoraEvent.objects.count(), 3)
+        self.assertIsNone(CallUser.objects.get(user=self.guest).left_at)
+
+    def test_late_events_do_not_rewind_state(self):
+        channel = self.call.channel_id
+        batches = [
+            [
+                self.parse("1", events.CHANNEL_CREATE, channel, 1000),
+                self.parse("2", events.AUDIENCE_JOIN, channel, 1000, self.guest.pk),
+                self.parse("3", events.AUDIENCE_LEAVE, channel, 2000, self.guest.pk),
+                self.parse("4", events.CHANNEL_DESTROY, channel, 5000),
+            ],
+            [
+                self.parse("5", events.AUDIENCE_JOIN, channel, 1500, self.guest.pk),
+                self.parse("6", events.CHANNEL_DESTROY, channel, 3000),
+            ],
+            [
+                self.parse("7", events.CHANNEL_CREATE, channel, 800),
+                self.parse("8", events.AUDIENCE_LEAVE, channel, 1800, self.guest.pk),
+            ],
+        ]
+        for batch in batches:
+            events.apply_events(batch)
+
+        self.call.refresh_from_db()
+        self.assertEqual(self.call.start_time.timestamp(), 800)
+        self.assertEqual(self.call.end_time.timestamp(), 5000)
+        self.assertEqual(self.call.status, Call.COMPLETED)
+        guest = CallUser.objects.get(user=self.guest)
+        self.assertEqual(guest.joined_at.timestamp(), 1000)
+        self.assertEqual(guest.left_at.timestamp(), 2000)
+
+        # A rejoin newer than the stored leave still clears it.
+        events.apply_events(
+            [self.parse("9", events.AUDIENCE_JOIN, channel, 2500, self.guest.pk)]
+        )
+        self.assertIsNone(CallUser.objects.get(user=self.guest).left_at)
+
+    def test_prunes_old_events(self):
+        channel = self.call.channel_id
+        events.apply_events(
+            [
+                self.parse("1", events.CHANNEL_CREATE, channel, 1000),
+                self.parse("2", events.AUDIENCE_JOIN, channel, 1010, self.guest.pk),
+            ]
+        )
+        AgoraEvent.objects.filter(notice_id="1").update(
+            received_at=timezone.now() - timedelta(hours=100)
+        )
+
+        call_command("prune_agora_events", "--chunk-size=1", stdout=StringIO())
+
+        self.assertEqual(
+            list(AgoraEvent.objects.values_list("notice_id", flat=True)), ["2"]
+        )
+
+    @override_settings(AGORA_EVENT_MAX_RETRIES=1, AGORA_EVENT_RETRY_DELAY=0)
+    def test_failed_batch_is_deferred(self):
+        event = self.parse("1", events.CHANNEL_CREATE, self.call.channel_id, 1000)
+        ingestor = events.EventIngestor()
+        with mock.patch("api.events.apply_events", side_effect=RuntimeError):
+            with self.assertLogs("api.events", level="WARNING"):
+                ingestor._apply([event])
+
+        self.assertEqual(ingestor.stats["deferred"], 1)
+        (deferred,) = claim_tasks(10)
+        self.assertTrue(run_deferred_task(deferred))
+        self.call.refresh_from_db()
+        self.assertEqual(self.call.status, Call.ONGOING)
+        self.assertTrue(AgoraEvent.objects.filter(notice_id="1").exists())
+
+
+calls = []
+
+
+@task
+def flaky(fail_times):
+    calls.append(fail_times)
+    if len(calls) <= fail_times:
+        raise RuntimeError("flaky")
+
+
+@override_settings(TASK_RETRY_DELAY=0, TASK_MAX_RETRIES=2, TASK_SUBMIT_TIMEOUT=0)
+class TaskExecutorTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_retries_until_success(self):
+        executor = TaskExecutor(workers=1)
+        with self.assertLogs("api.tasks", level="WARNING"):
+            executor.submit(flaky, 2)
+            executor.stop(timeout=5)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(executor.snapshot()["completed"], 1)
+
+    def test_gives_up_after_max_retries(self):
+        executor = TaskExecutor(workers=1)
+        with self.assertLogs("api.tasks", level="ERROR"):
+            executor.submit(flaky, 5)
+            executor.stop(timeout=5)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(executor.snapshot()["failed"], 1)
+
+    def test_full_queue_runs_inline(self):
+        executor = TaskExecutor(workers=1, max_queue_size=1)
+        started = threading.Event()
+        release = threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        block.task_name = "block"
+        executor.submit(block)
+        started.wait(5)
+        executor.submit(flaky, 0)  # fills the queue
+        executor.submit(flaky, 0)  # runs in this thread
+        self.assertEqual(executor.snapshot()["inline"], 1)
+        self.assertEqual(len(calls), 1)
+        release.set()
+        executor.stop(timeout=5)
+        self.assertEqual(len(calls), 2)
+
+
+@override_settings(TASK_RETRY_DELAY=0, TASK_MAX_RETRIES=1, TASK_LEASE_SECONDS=60)
+class DurableTaskTests(TestCase):
+    def setUp(self):
+        calls.clear()
+        self.user = get_user_model().objects.create(username="worker")
+        self.call = Call.objects.create()
+
+    def defer(self, func, *args):
+        return DeferredTask.objects.create(name=func.task_name, args=list(args))
+
+    def test_runs_and_deletes_task(self):
+        expiry = timezone.now().replace(microsecond=0)
+        self.defer(record_agora_token, self.call.pk, self.user.pk, "t", expiry)
+
+        (deferred,) = claim_tasks(10)
+        self.assertEqual(deferred.attempts, 1)
+        self.assertEqual(claim_tasks(10), [])
+        self.assertTrue(run_deferred_task(deferred))
+
+        self.assertFalse(DeferredTask.objects.exists())
+        self.assertEqual(AgoraToken.objects.get().expiry_time, expiry)
+
+    def test_failed_task_is_retried_then_marked_failed(self):
+        self.defer(flaky, 5)
+        with self.assertLogs("api.tasks", level="ERROR"):
+            (deferred,) = claim_tasks(10)
+            self.assertFalse(run_deferred_task(deferred))
+            DeferredTask.objects.update(run_after=timezone.now())
+            (deferred,) = claim_tasks(10)
+            self.assertFalse(run_deferred_task(deferred))
+
+        deferred = DeferredTask.objects.get()
+        self.assertEqual(deferred.status, DeferredTask.FAILED)
+        self.assertEqual(deferred.attempts, 2)
+        self.assertEqual(claim_tasks(10), [])
+
+    def test_expired_lease_is_reclaimed(self):
+        self.defer(flaky, 0)
+        (abandoned,) = claim_tasks(10)
+        self.assertEqual(claim_tasks(10), [])
+
+        DeferredTask.objects.update(run_after=timezone.now() - timedelta(seconds=1))
+        (reclaimed,) = claim_tasks(10)
+        self.assertEqual(reclaimed.attempts, 2)
+
+        # The original worker finishing late must not delete the new claim.
+        self.assertTrue(run_deferred_task(abandoned))
+        self.assertTrue(DeferredTask.objects.exists())
+        self.assertTrue(run_deferred_task(reclaimed))
+        self.assertFalse(DeferredTask.objects.exists())
+
+    def test_unregistered_name_is_not_run(self):
+        DeferredTask.objects.create(name="os.system", args=["true"])
+        with mock.patch("os.system") as system, self.assertLogs("api.tasks"):
+            (deferred,) = claim_tasks(10)
+            self.assertFalse(run_deferred_task(deferred))
+
+        system.assert_not_called()
+        deferred = DeferredTask.objects.get()
+        self.assertEqual(deferred.status, DeferredTask.FAILED)
+
+    def test_app_tasks_are_registered(self):
+        self.assertIn(events.apply_event.task_name, registry)
+        self.assertIn(telemetry.flush_telemetry.task_name, registry)
+
+
+class JoinCallViewTests(TestCase):
+    @mock.patch("api.views.defer")
+    @mock.patch("api.views.generate_agora_token", return_value="token")
+    def test_defers_token_with_real_expiry(self, generate_agora_token, defer):
+        user = get_user_model().objects.create(username="joiner")
+        call = Call.objects.create()
+        client = APIClient()
+        client.force_authenticate(user)
+
+        response = client.post(
+            "/api/v1/join-call/",
+            {"channel_id": call.channel_id, "role": "audience"},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        expiry_time = defer.call_args.args[-1]
+        self.assertIsNotNone(expiry_time.tzinfo)
+        self.assertGreater(expiry_time, timezone.now() + timedelta(weeks=51))
+        self.assertEqual(generate_agora_token.call_args.args[-1], expiry_time)
+
+
+SHUTDOWN_SCRIPT = """
+import time
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from api.models import Call, CallUser
+from api.tasks import defer, record_agora_token
+from api.telemetry import get_buffer
+
+user = get_user_model().objects.create(username="edge")
+call = Call.objects.create()
+call_user = CallUser.objects.create(call=call, user=user)
+for _ in range(5):
+    defer(record_agora_token, call.pk, user.pk, "token", timezone.now())
+get_buffer().add(call.pk, call_user.pk, [(int(time.time() * 1000), [500, 0, 40, 30])])
+"""
+
+
+WRITER_CONNECTIONS_SCRIPT = """
+import threading
+from django.db.backends.signals import connection_created
+from api.models import Call
+from api.sqlite import serialized_write
+
+opened = []
+connection_created.connect(
+    lambda **kwargs: opened.append(threading.current_thread().name), weak=False
+)
+for _ in range(20):
+    serialized_write(Call.objects.create)
+print(opened.count("sqlite-writer"))
+"""
+
+
+class SingleWriterTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "edge.sqlite3")
+        self.manage("migrate", "-v0")
+
+    def manage(self, *command):
+        env = {
+            **os.environ,
+            "DJANGO_SETTINGS_MODULE": "Agora_caller.settings",
+            "SQLITE_PATH": self.path,
+            "SQLITE_CONCURRENT": "true",
+            "SQLITE_SINGLE_WRITER": "true",
+            "TASK_QUEUE_DURABLE": "false",
+        }
+        return subprocess.run(
+            [sys.executable, os.path.join(settings.BASE_DIR, "manage.py"), *command],
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+
+    def test_pending_writes_drain_at_exit(self):
+        self.manage("shell", "-c", SHUTDOWN_SCRIPT)
+
+        with closing(sqlite3.connect(self.path)) as db:
+            tokens = db.execute("SELECT COUNT(*) FROM api_agoratoken").fetchone()
+            chunks = db.execute("SELECT COUNT(*) FROM api_telemetrychunk").fetchone()
+        self.assertEqual((tokens[0], chunks[0]), (5, 1))
+
+    def test_writer_reuses_its_connection(self):
+        completed = self.manage("shell", "-c", WRITER_CONNECTIONS_SCRIPT)
+        self.assertEqual(completed.stdout.split()[-1], "1")
+
+
+class SeriesTests(SimpleTestCase):
+    def series(self, rows):
+        series = Series()
+        for offset, values in rows:
+            series.append(offset, values)
+        return series
+
+    def test_pack_round_trip(self):
+        series = self.series([(0, [500, 0.5, 40, 30]), (2000, [700.25, 1, 60, 24])])
+        unpacked = Series.unpack(series.pack(), len(series))
+        self.assertEqual(list(unpacked.offsets), [0, 2000])
+        for metric in telemetry.METRICS:
+            self.assertEqual(unpacked.columns[metric], series.columns[metric])
+
+    def test_downsample_averages_buckets(self):
+        series = self.series(
+            [(0, [100, 0, 10, 30]), (1000, [300, 2, 30, 30]), (5000, [50, 0, 0, 0])]
+        )
+        downsampled = series.downsample(5000)
+        self.assertEqual(list(downsampled.offsets), [0, 5000])
+        self.assertEqual(list(downsampled.columns["bitrate"]), [200, 50])
+
+    def test_percentile_estimate(self):
+        edges = (0, 10, 20)
+        # 10 samples in [0, 10), 10 in [10, 20), observed range 2..18.
+        self.assertEqual(telemetry._percentile(edges, [10, 10, 0], 20, 50, 2, 18), 10)
+        self.assertEqual(telemetry._percentile(edges, [10, 10, 0], 20, 75, 2, 18), 14)
+        # The open-ended last bucket is bounded by the observed max.
+        self.assertEqual(telemetry._percentile(edges, [0, 0, 4], 4, 100, 25, 40), 40)
+
+    def test_rejects_invalid_samples(self):
+        now = int(time.time() * 1000)
+        valid = {"ts": now, "bitrate": 1, "packet_loss": 0, "rtt": 1, "frame_rate": 1}
+        self.assertEqual(len(telemetry.parse_samples([valid])), 1)
+        for change in [
+            {"bitrate": "nan"},
+            {"rtt": "inf"},
+            {"rtt": 1e39},
+            {"packet_loss": -1},
+            {"ts": now + 3600 * 1000},
+            {"ts": 10**30},
+            {"ts": "soon"},
+        ]:
+            with self.assertRaises(telemetry.InvalidSample):
+                telemetry.parse_samples([{**valid, **change}])
+
+
+class TelemetryTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create(username="reporter")
+        self.other = User.objects.create(username="other")
+        self.call = Call.objects.create()
+        self.call_user = CallUser.objects.create(call=self.call, user=self.user)
+        self.other_call_user = CallUser.objects.create(call=self.call, user=self.other)
+        self.window_ms = settings.TELEMETRY_WINDOW_SECONDS * 1000
+        now = int(time.time() * 1000)
+        self.window_start = now - now % self.window_ms
+
+    def test_merges_into_existing_chunk(self):
+        first = Series()
+        first.append(0, [100, 0, 10, 30])
+        second = Series()
+        second.append(1000, [300, 4, 30, 24])
+        for series in [first, second]:
+            telemetry.persist_series(
+                self.call.pk, self.call_user.pk, self.window_start, series
+            )
+
+        chunk = TelemetryChunk.objects.get()
+        self.assertEqual((chunk.sample_count, chunk.point_count), (2, 2))
+        self.assertEqual(chunk.bitrate_sum, 400)
+        self.assertEqual((chunk.rtt_min, chunk.rtt_max), (10, 30))
+        stored = Series.unpack(chunk.data, chunk.point_count)
+        self.assertEqual(list(stored.offsets), [0, 1000])
+        self.assertEqual(sum(telemetry._from_bytes("I", chunk.histograms)), 8)
+
+    def test_merges_into_downsampled_chunk(self):
+        def persist(*rows):
+            series = Series()
+            for offset, bitrate in rows:
+                series.append(offset, [bitrate, 0, 10, 30])
+            telemetry.persist_series(
+                self.call.pk, self.call_user.pk, self.window_start, series
+            )
+
+        persist((0, 100), (1000, 200), (2000, 300))
+        call_command("downsample_telemetry", "--hours=0", stdout=StringIO())
+        persist((40000, 50), (500, 600))
+
+        chunk = TelemetryChunk.objects.get()
+        self.assertEqual((chunk.sample_count, chunk.point_count), (5, 2))
+        stored = Series.unpack(chunk.data, chunk.point_count)
+        self.assertEqual(list(stored.offsets), [0, 30000])
+        self.assertEqual(list(stored.columns["bitrate"]), [300, 50])
+
+    def test_failed_flush_is_retried(self):
+        buffer = TelemetryBuffer()
+        buffer.add(self.call.pk, self.call_user.pk, [(self.window_start, [1, 0, 1, 1])])
+        with mock.patch(
+            "api.telemetry.persist_series", side_effect=RuntimeError
+        ), self.assertLogs("api.telemetry"):
+            self.assertEqual(buffer.flush(force=True), 0)
+        buffer.add(
+            self.call.pk, self.call_user.pk, [(self.window_start + 1, [3, 0, 1, 1])]
+        )
+
+        self.assertEqual(buffer.flush(force=True), 1)
+        chunk = TelemetryChunk.objects.get()
+        self.assertEqual((chunk.sample_count, chunk.bitrate_sum), (2, 4))
+
+    @mock.patch("api.views.get_executor")
+    def test_upload_and_query(self, get_executor):
+        buffer = TelemetryBuffer()
+        client = APIClient()
+        with mock.patch("api.views.get_buffer", return_value=buffer):
+            for user, bitrates in [(self.user, [400, 600]), (self.other, [1000])]:
+                client.force_authenticate(user)
+                samples = [
+                    {
+                        "ts": self.window_start + i,
+                        "bitrate": bitrate,
+                        "packet_loss": 1,
+                        "rtt": 50,
+                        "frame_rate": 30,
+                    }
+                    for i, bitrate in enumerate(bitrates)
+                ]
+                response = client.post(
+                    "/api/v1/telemetry/",
+                    {"channel_id": self.call.channel_id, "samples": samples},
+                    format="json",
+                )
+                self.assertEqual(response.status_code, 200)
+
+            bad = {**samples[0], "bitrate": "nan"}
+            response = client.post(
+                "/api/v1/telemetry/",
+                {"channel_id": self.call.channel_id, "samples": [bad]},
+                format="json",
+            )
+            self.assertEqual(response.status_code, 400)
+
+        # Open windows are not written by queries.
+        response = client.get(f"/api/v1/telemetry/{self.call.channel_id}/")
+        self.assertEqual(response.json()["samples"], 0)
+        self.assertEqual(buffer.flush(force=True), 2)
+        response = client.get(f"/api/v1/telemetry/{self.call.channel_id}/")
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["samples"], 3)
+        bitrate = data["metrics"]["bitrate"]
+        self.assertEqual((bitrate["min"], bitrate["max"]), (400, 1000))
+        self.assertAlmostEqual(bitrate["mean"], 2000 / 3)
+        self.assertTrue(400 <= bitrate["p50"] <= 1000)
+        participants = {p["user"]: p for p in data["participants"]}
+        self.assertEqual(participants["reporter"]["samples"], 2)
+        self.assertEqual(participants["reporter"]["metrics"]["bitrate"]["mean"], 500)
+
+    def test_query_requires_participant(self):
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create(username="stranger"))
+        response = client.get(f"/api/v1/telemetry/{self.call.channel_id}/")
+        self.assertEqual(response.status_code, 400)
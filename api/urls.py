@@ -6,6 +6,10 @@ from .views import (
     RtcTokenView,
     AgoraTokenListView,
     JoinCallView,
+    AgoraEventView,
+    TaskStatsView,
+    TelemetryUploadView,
+    CallTelemetryView,
 )
 
 urlpatterns = [
@@ -17,4 +21,12 @@ urlpatterns = [
     path(
         "join-call/", JoinCallView.as_view(), name="join-call"
     ),  # Add this line for the Join Call view
+    path("agora-events/", AgoraEventView.as_view(), name="agora-events"),
+    path("task-stats/", TaskStatsView.as_view(), name="task-stats"),
+    path("telemetry/", TelemetryUploadView.as_view(), name="telemetry"),
+    path(
+        "telemetry/<str:channel_id>/",
+        CallTelemetryView.as_view(),
+        name="call-telemetry",
+    ),
 ]
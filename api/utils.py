@@ -1,20 +1,29 @@
 import os
-from datetime import datetime, timedelta
+from datetime import timedelta
 from agora_token_builder import RtcTokenBuilder
+from django.utils import timezone
 
 AGORA_APP_ID = os.getenv("AGORA_APP_ID")
 AGORA_APP_CERTIFICATE = os.getenv("AGORA_APP_CERTIFICATE")
 
+TOKEN_LIFETIME = timedelta(weeks=52)
 
-def generate_agora_token(uid, channel_name, role):
+
+def token_expiry():
+    """
+    Returns the timezone-aware expiry time for a token issued now.
+    """
+    return timezone.now() + TOKEN_LIFETIME
+
+
+def generate_agora_token(uid, channel_name, role, expiry_time=None):
     """
     Generates an Agora token for a given user (`uid`) and channel (`channel_name`)
-    with a specified role (`host` or `audience`).
+    with a specified role (`host` or `audience`), valid until `expiry_time`
+    (`TOKEN_LIFETIME` from now by default).
     """
     role_enum = 1 if role == "host" else 2
-    expiration_time = datetime.utcnow() + timedelta(
-        weeks=52
-    )  # Token expiry in 52 weeks
+    expiration_time = expiry_time or token_expiry()
     expire_timestamp = int(expiration_time.timestamp())
 
     token = RtcTokenBuilder.build_token_with_uid(
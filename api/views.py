@@ -1,13 +1,25 @@
-from rest_framework.permissions import IsAuthenticated
+import json
+
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, generics
-from datetime import datetime
 from django.contrib.auth import get_user_model
 from django.contrib.auth.hashers import make_password, check_password
-from .models import Call, CallUser, AgoraToken
+from .models import Call, CallUser, AgoraToken, DeferredTask
+from .events import InvalidEvent, get_ingestor, parse_event, verify_signature
+from .sqlite import serialized_write
+from .tasks import defer, get_executor, record_agora_token
+from .telemetry import (
+    InvalidSample,
+    flush_telemetry,
+    get_buffer,
+    parse_samples,
+    summarize_call,
+)
 from .utils import (
     generate_agora_token,
+    token_expiry,
 )
 
 
@@ -85,13 +97,16 @@ class CreateCallView(APIView):
             user = request.user
             call_type = request.data.get("call_type", "video")
 
-            call = Call.objects.create(
+            call = serialized_write(
+                Call.objects.create,
                 call_type=call_type,
                 status=Call.PENDING,
             )
 
             # Associate the user as the host
-            CallUser.objects.create(call=call, user=user, role=CallUser.HOST)
+            serialized_write(
+                CallUser.objects.create, call=call, user=user, role=CallUser.HOST
+            )
 
             return Response(
                 {
@@ -137,15 +152,11 @@ class RtcTokenView(APIView):
                 )
 
             # Generate the Agora token
-            token = generate_agora_token(uid, channel_id, role)
+            expiry_time = token_expiry()
+            token = generate_agora_token(uid, channel_id, role, expiry_time)
 
-            # Calculate the expiry time (for example, 1 hour from now)
-            expiry_time = datetime.utcnow()
-
-            # Store the token in the AgoraToken model
-            AgoraToken.objects.create(
-                call=call, user=request.user, token=token, expiry_time=expiry_time
-            )
+            # Store the token in the AgoraToken model off the request path
+            defer(record_agora_token, call.pk, request.user.pk, token, expiry_time)
 
             return Response({"token": token, "code": 200}, status=status.HTTP_200_OK)
         except Exception as e:
@@ -180,16 +191,24 @@ class JoinCallView(APIView):
                 print(call_user)
             except CallUser.DoesNotExist:
                 if role == "host":
-                    CallUser.objects.create(call=call, user=user, role=CallUser.HOST)
+                    serialized_write(
+                        CallUser.objects.create,
+                        call=call,
+                        user=user,
+                        role=CallUser.HOST,
+                    )
                 else:
-                    CallUser.objects.create(
-                        call=call, user=user, role=CallUser.AUDIENCE
+                    serialized_write(
+                        CallUser.objects.create,
+                        call=call,
+                        user=user,
+                        role=CallUser.AUDIENCE,
                     )
 
             uid = user.id
-            token = generate_agora_token(uid, channel_id, role)
-
-            AgoraToken.objects.create(call=call, user=user, token=token)
+            expiry_time = token_expiry()
+            token = generate_agora_token(uid, channel_id, role, expiry_time)
+            defer(record_agora_token, call.pk, user.pk, token, expiry_time)
 
             return Response({"token": token, "code": 200}, status=status.HTTP_200_OK)
 
@@ -215,3 +234,126 @@ class AgoraTokenListView(APIView):
             return Response({"tokens": token_data}, status=status.HTTP_200_OK)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class AgoraEventView(APIView):
+    """
+    Receives Agora channel event notifications. Events are queued and applied
+    in batches by the background ingestor rather than on the request path.
+    """
+
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        body = request.body
+        if not verify_signature(
+            body,
+            signature=request.headers.get("Agora-Signature"),
+            signature_v2=request.headers.get("Agora-Signature-V2"),
+        ):
+            return Response(
+                {"error": "Invalid signature."}, status=status.HTTP_401_UNAUTHORIZED
+            )
+
+        try:
+            event = parse_event(json.loads(body))
+        except (ValueError, InvalidEvent) as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if event is not None and not get_ingestor().submit(event):
+            return Response(
+                {"error": "Event queue is full, retry later."},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
+
+        return Response({"code": 200}, status=status.HTTP_200_OK)
+
+
+class TaskStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(
+            {
+                "executor": get_executor().snapshot(),
+                "durable": {
+                    "pending": DeferredTask.objects.filter(
+                        status=DeferredTask.PENDING
+                    ).count(),
+                    "failed": DeferredTask.objects.filter(
+                        status=DeferredTask.FAILED
+                    ).count(),
+                },
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class TelemetryUploadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        try:
+            channel_id = request.data.get("channel_id")
+
+            try:
+                call_user = CallUser.objects.get(
+                    call__channel_id=channel_id, user=request.user
+                )
+            except CallUser.DoesNotExist:
+                return Response(
+                    {"error": "User is not part of this call."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+            try:
+                samples = parse_samples(request.data.get("samples"))
+            except InvalidSample as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+            buffer = get_buffer()
+            buffer.add(call_user.call_id, call_user.pk, samples)
+            # Closed windows are written by the background executor; the
+            # buffer lives in this process, so the durable queue is bypassed.
+            if buffer.flush_due():
+                get_executor().submit(flush_telemetry)
+
+            return Response(
+                {"accepted": len(samples), "code": 200}, status=status.HTTP_200_OK
+            )
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class CallTelemetryView(APIView):
+    """
+    Returns call quality aggregates from the stored telemetry chunks. Samples
+    are buffered by the process that received them, so the current window is
+    only included once it has closed and been flushed.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, channel_id):
+        try:
+            try:
+                call = Call.objects.get(channel_id=channel_id)
+            except Call.DoesNotExist:
+                return Response(
+                    {"error": "Call with the provided channel_id does not exist."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+            if not CallUser.objects.filter(call=call, user=request.user).exists():
+                return Response(
+                    {"error": "User is not part of this call."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+            return Response(
+                {"channel_id": call.channel_id, **summarize_call(call)},
+                status=status.HTTP_200_OK,
+            )
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)